@@ -1,17 +1,73 @@
-from fastapi import FastAPI, HTTPException
+from collections import OrderedDict
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from functools import lru_cache
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from groq import Groq
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field, TypeAdapter
+from groq import AsyncGroq
 from dotenv import load_dotenv
-import os, json, logging
+import os, logging, asyncio, hashlib
+import httpx
+import orjson
 
 # ===== Load env =====
 load_dotenv()
 API_KEY = os.getenv("GROQ_API_KEY")
 
-client = Groq(api_key=API_KEY) if API_KEY else None
+# Cap in-flight Groq calls so bursts queue here instead of tripping 429s;
+# the SDK retries remaining 429/5xx responses with exponential backoff.
+# Streams get their own pool: the client's read speed decides how long a
+# stream holds its slot, so slow readers must not starve buffered reviews.
+LLM_MAX_INFLIGHT = int(os.getenv("LLM_MAX_INFLIGHT", "32"))
+LLM_MAX_STREAMS = int(os.getenv("LLM_MAX_STREAMS", "8"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
 
-app = FastAPI(title="Code Intelligence API", version="3.0")
+@dataclass
+class LLM:
+    client: AsyncGroq
+    semaphore: asyncio.Semaphore
+    stream_semaphore: asyncio.Semaphore
+
+# ===== LLM client (shared connection pool, per app lifespan) =====
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if not API_KEY:
+        app.state.llm = None
+        yield
+        return
+
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+        timeout=httpx.Timeout(60.0, connect=5.0),
+    )
+    app.state.llm = LLM(
+        client=AsyncGroq(
+            api_key=API_KEY, http_client=http_client, max_retries=LLM_MAX_RETRIES
+        ),
+        semaphore=asyncio.Semaphore(LLM_MAX_INFLIGHT),
+        stream_semaphore=asyncio.Semaphore(LLM_MAX_STREAMS),
+    )
+    try:
+        yield
+    finally:
+        app.state.llm = None
+        await http_client.aclose()
+
+def get_llm(request: Request) -> LLM:
+    llm = getattr(request.app.state, "llm", None)
+    if not llm:
+        raise HTTPException(status_code=503, detail="LLM not configured")
+    return llm
+
+app = FastAPI(
+    title="Code Intelligence API",
+    version="3.0",
+    lifespan=lifespan,
+)
 logging.basicConfig(level=logging.INFO)
 
 # ===== CORS (env driven) =====
@@ -41,51 +97,214 @@ class ReviewResponse(BaseModel):
     rewritten_code: str
     summary: str
 
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "50"))
+
+class BatchReviewRequest(BaseModel):
+    items: list[ReviewRequest] = Field(..., min_length=1, max_length=BATCH_MAX_ITEMS)
+
+class BatchItemError(BaseModel):
+    error: str
+
+def batch_item(result: ReviewResponse | BaseException) -> ReviewResponse | BatchItemError:
+    if isinstance(result, HTTPException):
+        return BatchItemError(error=result.detail)
+    if isinstance(result, BaseException):
+        return BatchItemError(error="AI processing error")
+    return result
+
+batch_response_adapter = TypeAdapter(list[ReviewResponse | BatchItemError])
+
 # ===== Root =====
 @app.get("/")
 def root():
     return {"status": "running"}
 
-# ===== Endpoint =====
-@app.post("/api/review", response_model=ReviewResponse)
-def review_code(req: ReviewRequest):
-    if not client:
-        raise HTTPException(status_code=503, detail="LLM not configured")
+# ===== Response cache (in-process LRU) =====
+CACHE_MAX_ENTRIES = 1024
+CacheKey = tuple[str, tuple[str, ...]]
+_review_cache: OrderedDict[CacheKey, ReviewResponse] = OrderedDict()
 
-    focus = ", ".join(req.focus_areas) if req.focus_areas else "overall quality"
+def cache_key(req: ReviewRequest) -> CacheKey:
+    digest = hashlib.blake2b(req.code.encode(), digest_size=16).hexdigest()
+    return digest, tuple(sorted(req.focus_areas))
 
-    prompt = f"""
-You are a senior code reviewer.
+def store_review(key: CacheKey, data: ReviewResponse) -> None:
+    _review_cache[key] = data
+    _review_cache.move_to_end(key)
+    if len(_review_cache) > CACHE_MAX_ENTRIES:
+        _review_cache.popitem(last=False)
+
+# ===== Prompt =====
+# Static instructions go first, byte-identical on every call, so the
+# provider can reuse the cached prefix across requests.
+SYSTEM_PROMPT = """You are a senior code reviewer.
 
 Return ONLY valid JSON with this schema:
-{{
- "issues":[{{"severity":"critical|high|medium|low","description":"string","line":number|null}}],
+{
+ "issues":[{"severity":"critical|high|medium|low","description":"string","line":number|null}],
  "risk_score":0-100,
  "summary":"string",
  "rewritten_code":"string"
-}}
+}"""
+
+@lru_cache(maxsize=256)
+def focus_str(areas: tuple[str, ...]) -> str:
+    return ", ".join(areas) if areas else "overall quality"
+
+def build_messages(req: ReviewRequest) -> list[dict]:
+    focus = focus_str(tuple(sorted(req.focus_areas)))
 
-Focus on: {focus}
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"Focus on: {focus}\n\nCode:\n{req.code}"},
+    ]
 
-Code:
-{req.code}
-"""
+# ===== Parsing =====
+PARSE_INLINE_LIMIT = 8192
+
+async def parse_review(content: str) -> ReviewResponse:
+    # Small replies parse faster inline than the threadpool hop costs.
+    if len(content) < PARSE_INLINE_LIMIT:
+        return ReviewResponse.model_validate_json(content)
+    return await run_in_threadpool(ReviewResponse.model_validate_json, content)
+
+# ===== Review =====
+async def run_review(
+    llm: LLM, req: ReviewRequest, use_cache: bool = True
+) -> ReviewResponse:
+    key = cache_key(req)
+    if use_cache and key in _review_cache:
+        _review_cache.move_to_end(key)
+        logging.info("Review cache hit")
+        return _review_cache[key]
+
+    messages = build_messages(req)
 
     try:
-        res = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            temperature=0.1,
-            max_tokens=2000,
-            messages=[{"role": "user", "content": prompt}],
-        )
+        async with llm.semaphore:
+            res = await llm.client.chat.completions.create(
+                model="llama-3.3-70b-versatile",
+                temperature=0.1,
+                max_tokens=2000,
+                response_format={"type": "json_object"},
+                messages=messages,
+            )
 
         content = res.choices[0].message.content
-        data = json.loads(content)
+        data = await parse_review(content)
 
         logging.info("Review generated")
 
-        return data
-
     except Exception:
         logging.exception("LLM failure")
         raise HTTPException(status_code=500, detail="AI processing error")
+
+    store_review(key, data)
+
+    return data
+
+def sse(payload: dict) -> bytes:
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+async def stream_review(
+    llm: LLM, req: ReviewRequest, use_cache: bool = True
+) -> AsyncIterator[bytes]:
+    key = cache_key(req)
+    if use_cache and key in _review_cache:
+        _review_cache.move_to_end(key)
+        logging.info("Review cache hit")
+        yield sse({"result": _review_cache[key].model_dump()})
+        return
+
+    parts: list[str] = []
+
+    try:
+        async with llm.stream_semaphore:
+            stream = await llm.client.chat.completions.create(
+                model="llama-3.3-70b-versatile",
+                temperature=0.1,
+                max_tokens=2000,
+                messages=build_messages(req),
+                stream=True,
+            )
+
+            # Close the upstream response before the slot is released, also
+            # when the client disconnects and the generator is closed mid-stream.
+            async with stream:
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        parts.append(delta)
+                        yield sse({"delta": delta})
+
+        data = await parse_review("".join(parts))
+
+        logging.info("Review streamed")
+
+    except Exception:
+        logging.exception("LLM failure")
+        yield sse({"error": "AI processing error"})
+        return
+
+    store_review(key, data)
+
+    yield sse({"result": data.model_dump()})
+
+# ===== Endpoints =====
+@app.post("/api/review", response_model=ReviewResponse)
+async def review_code(
+    req: ReviewRequest,
+    no_cache: bool = False,
+    llm: LLM = Depends(get_llm),
+):
+    # Already validated in run_review; skip FastAPI's response re-validation.
+    data = await run_review(llm, req, use_cache=not no_cache)
+    return Response(data.model_dump_json(), media_type="application/json")
+
+@app.post("/api/review/stream")
+async def review_stream(
+    req: ReviewRequest,
+    no_cache: bool = False,
+    llm: LLM = Depends(get_llm),
+):
+    return StreamingResponse(
+        stream_review(llm, req, use_cache=not no_cache),
+        media_type="text/event-stream",
+    )
+
+@app.post("/api/review/batch", response_model=list[ReviewResponse | BatchItemError])
+async def review_batch(
+    batch: BatchReviewRequest,
+    max_concurrency: int = Query(10, ge=1, le=50),
+    no_cache: bool = False,
+    llm: LLM = Depends(get_llm),
+):
+    sem = asyncio.Semaphore(max_concurrency)
+
+    async def bounded(item: ReviewRequest) -> ReviewResponse:
+        async with sem:
+            return await run_review(llm, item, use_cache=not no_cache)
+
+    # One failed item must not discard (or orphan) the rest of the batch.
+    results = await asyncio.gather(
+        *(bounded(item) for item in batch.items), return_exceptions=True
+    )
+    results = [batch_item(r) for r in results]
+    return Response(batch_response_adapter.dump_json(results), media_type="application/json")
+
+# ===== Local / container entrypoint =====
+# "auto" picks uvloop and httptools when installed (uvicorn[standard] ships
+# uvloop everywhere except Windows, Cygwin and PyPy) and falls back to
+# asyncio/h11 otherwise. Set UVICORN_LOOP=uvloop / UVICORN_HTTP=httptools to
+# require them.
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        "backend.main:app",
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "8000")),
+        loop=os.getenv("UVICORN_LOOP", "auto"),
+        http=os.getenv("UVICORN_HTTP", "auto"),
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+    )